@@ -1,14 +1,35 @@
 import folium
+from folium.plugins import MarkerCluster
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import time
+import hashlib
+import gzip
+import logging
 from datetime import datetime, time as dtime, timedelta, timezone
 import json
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # 환경 변수 로드
 load_dotenv()
 
+logger = logging.getLogger('SellBuildingData')
+
 vworld_apikey = os.environ.get('VWORLD_APIKEY', 'YOUR_DEFAULT_KEY')
 airtable_api_key = os.environ.get('AIRTABLE_API_KEY', 'YOUR_DEFAULT_API_KEY')
 
@@ -17,473 +38,656 @@ table_id = 'tblnR438TK52Gr0HB'
 address_field = '지번 주소'
 price_field = '매가(만원)'
 status_field = '현황'
+geocode_cache_file = '/home/sftpuser/www/geocode_cache.json'
+geocode_cache_ttl = 30 * 86400  # 지오코딩 캐시 유효 기간(초)
+vworld_tile_url = 'https://goldenrabbit.biz/api/vtile?z={z}&y={y}&x={x}'
+
+# 지오코딩 요청마다 주소만 바뀌므로 고정 파라미터는 한 번만 만들어 둠
+vworld_geocode_url = "https://api.vworld.kr/req/address"
+vworld_geocode_params = {
+    "service": "address",
+    "request": "getcoord",
+    "format": "json",
+    "crs": "EPSG:4326",
+    "type": "PARCEL",
+    "key": vworld_apikey
+}
 
+map_css_file = '/home/sftpuser/www/airtable_map.css'
+font_css_url = 'https://fonts.googleapis.com/css2?family=Noto+Sans+KR:wght@400;700&display=swap'
+
+# 지도 페이지 스타일 (airtable_map.css로 저장되어 지도 HTML과 별도로 캐시됨)
+map_css = """/* 가격 말풍선 스타일 */
+.price-bubble {
+    background-color: #fff;
+    border: 2px solid #e38000;
+    border-radius: 6px;
+    box-shadow: 0 2px 5px rgba(0,0,0,0.2);
+    padding: 3px 6px;
+    font-size: 13px;
+    font-weight: bold;
+    color: #e38000;
+    white-space: nowrap;
+    text-align: center;
+    position: absolute;
+    left: 50%;
+    transform: translateX(-50%);
+    width: 70px;
+}
+.price-bubble:after {
+    content: '';
+    position: absolute;
+    bottom: -8px;
+    left: 50%;
+    margin-left: -8px;
+    width: 0;
+    height: 0;
+    border-left: 8px solid transparent;
+    border-right: 8px solid transparent;
+    border-top: 8px solid #e38000;
+}
+
+/* 팝업창 스타일 */
+.leaflet-popup-content-wrapper {
+    border-radius: 8px;
+    box-shadow: 0 3px 8px rgba(0,0,0,0.2);
+    padding: 0;
+}
+.leaflet-popup-content {
+    margin: 8px 10px;
+    font-size: 14px;
+    line-height: 1.5;
+}
+.leaflet-popup-tip {
+    box-shadow: 0 3px 8px rgba(0,0,0,0.2);
+}
+.popup-content {
+    font-family: 'Noto Sans KR', sans-serif;
+}
+.popup-title {
+    font-size: 16px;
+    font-weight: bold;
+    margin-bottom: 6px;
+    color: #333;
+}
+.popup-info {
+    margin-top: 2px;
+    color: #444;
+}
+/* 상세내역 보기 링크 스타일 */
+.detail-link {
+    display: block;
+    margin-top: 10px;
+    padding: 5px;
+    background-color: #f5f5f5;
+    border-top: 1px solid #e0e0e0;
+    text-align: center;
+    font-weight: bold;
+    color: #e38000;
+    cursor: pointer;
+    text-decoration: none;
+    border-radius: 0 0 6px 6px;
+}
+.detail-link:hover {
+    background-color: #e6e6e6;
+}
+"""
+# 스타일이 바뀌면 링크 주소도 바뀌도록 내용 해시를 버전 파라미터로 사용
+map_css_version = hashlib.blake2b(map_css.encode('utf-8'), digest_size=4).hexdigest()
+
+# 지도(팝업, 필터)에서 실제로 사용하는 필드만 요청
 additional_fields = {
     '토지면적(㎡)': '토지면적(㎡)',
-    '연면적(㎡)': '연면적(㎡)',
-    '건폐율(%)': '건폐율(%)',
-    '용적률(%)': '용적률(%)',
-    '용도지역': '용도지역',
     '주용도': '주용도',
     '층수': '층수',
     '사용승인일': '사용승인일',
-    '보증금(만원)': '보증금(만원)',
-    '월세(만원)': '월세(만원)',
-    '인접역': '인접역',
-    '거리(m)': '거리(m)',
-    '상세설명': '상세설명',
     '실투자금': '실투자금',
     '융자제외수익률(%)': '융자제외수익률(%)'
 }
 
-def get_airtable_data():
+# 레코드마다 additional_fields.items()를 다시 풀지 않도록 이름 목록을 미리 계산
+additional_display_names = tuple(additional_fields.keys())
+additional_field_names = tuple(additional_fields.values())
+
+valid_status = frozenset(("네이버", "디스코", "당근", "비공개"))
+
+# 지도에 쓰는 필드만 요청하고, 주소가 없거나 현황이 맞지 않는 레코드는 에어테이블 서버에서 먼저 제외
+# (현황이 다중 선택일 수 있어 문자열로 합친 뒤 FIND로 검사하며, 정확한 일치는 parse_airtable_record에서 다시 확인)
+status_formula = "OR(" + ", ".join(f"FIND('{s}', {{{status_field}}} & '')" for s in sorted(valid_status)) + ")"
+airtable_params = {
+    'pageSize': 100,
+    'fields[]': [address_field, price_field, status_field, *additional_field_names],
+    'filterByFormula': f"AND({{{address_field}}} != '', {status_formula})",
+}
+
+# HTTP 연결 재사용(keep-alive)으로 페이지마다 TLS 핸드셰이크를 반복하지 않도록 세션을 공유
+# (에어테이블과 브이월드 모두 이 세션을 사용하며, 응답 없는 연결이 스레드를 붙잡지 않도록 타임아웃 지정)
+request_timeout = (3, 10)
+session = requests.Session()
+session.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+))
+
+def dumps_json(obj):
+    """JSON 문자열로 직렬화 (orjson이 설치되어 있으면 사용, 없으면 공백 없는 표준 json)"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+def loads_json(data):
+    """JSON 응답 본문(bytes) 파싱 (orjson이 설치되어 있으면 사용)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def parse_airtable_record(record):
+    record_id = record.get('id')
+    fields = record.get('fields', {})
+    address = fields.get(address_field)
+    name = address
+    price = fields.get(price_field)
+    status = fields.get(status_field)
+
+    is_valid_status = False
+    if address and status:
+        if isinstance(status, list):
+            is_valid_status = not valid_status.isdisjoint(status)
+        elif isinstance(status, str):
+            is_valid_status = status in valid_status
+
+    if not (address and is_valid_status):
+        return None
+
+    # int()가 숫자 문자열/정수/실수를 모두 처리하므로 변환 실패 시에만 원래 값을 유지
+    try:
+        if price is not None:
+            price = int(price)
+    except (TypeError, ValueError):
+        pass
+    field_values = dict(zip(additional_display_names, map(fields.get, additional_field_names)))
+    return (name, address, price, status, field_values, record_id)
+
+def iter_airtable_pages(params):
+    """에어테이블 목록 API의 페이지별 레코드 리스트를 순서대로 반환하는 제너레이터"""
     url = f'https://api.airtable.com/v0/{base_id}/{table_id}'
     headers = {
         'Authorization': f'Bearer {airtable_api_key}',
         'Content-Type': 'application/json'
     }
 
-    all_records = []
-    offset = None
+    # Airtable 페이지네이션은 offset 커서 방식이라 다음 페이지 요청을 병렬로 보낼 수 없으므로,
+    # 다음 페이지를 백그라운드에서 미리 요청해 두고 그 동안 호출자가 현재 페이지를 처리하게 한다.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(session.get, url, headers=headers, params=params, timeout=request_timeout)
+        while future is not None:
+            response = future.result()
+            if response.status_code != 200:
+                logger.error("에어테이블 API 오류: %s %s", response.status_code, response.text)
+                return
+
+            data = loads_json(response.content)
+            offset = data.get('offset')
+            future = executor.submit(session.get, url, headers=headers, params={**params, 'offset': offset}, timeout=request_timeout) if offset else None
+            records = data.get('records', [])
+            logger.debug("에어테이블 페이지 수신: %d개 레코드", len(records))
+            yield records
+
+def get_airtable_data(limit=None):
+    """지도에 표시할 매물 목록 조회
 
+    limit을 지정하면 에어테이블의 maxRecords로 전달해 서버에서 페이지네이션을 멈춘다.
+    서버의 현황 필터는 FIND 부분 일치라서 parse_airtable_record의 정확한 검사에서 제외되는
+    레코드가 있을 수 있으므로, 반환되는 매물 수는 limit보다 적을 수 있다.
+    """
+    params = airtable_params if limit is None else {**airtable_params, 'maxRecords': limit}
+    address_data = []
     try:
-        while True:
-            params = {}
-            if offset:
-                params['offset'] = offset
-            response = requests.get(url, headers=headers, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                records = data.get('records', [])
-                all_records.extend(records)
-                offset = data.get('offset')
-                if not offset:
-                    break
-            else:
-                print(f"에어테이블 API 오류: {response.status_code}")
-                print(response.text)
+        for records in iter_airtable_pages(params):
+            for record in records:
+                row = parse_airtable_record(record)
+                if row:
+                    address_data.append(row)
+            if limit is not None and len(address_data) >= limit:
                 break
-
-        address_data = []
-        for record in all_records:
-            record_id = record.get('id')
-            fields = record.get('fields', {})
-            address = fields.get(address_field)
-            name = address
-            price = fields.get(price_field)
-            status = fields.get(status_field)
-
-            field_values = {display_name: fields.get(field_name) for display_name, field_name in additional_fields.items()}
-
-            valid_status = ["네이버", "디스코", "당근", "비공개"]
-            is_valid_status = False
-            if address and status:
-                if isinstance(status, list):
-                    is_valid_status = any(s in valid_status for s in status)
-                elif isinstance(status, str):
-                    is_valid_status = status in valid_status
-
-            if address and is_valid_status:
-                try:
-                    if isinstance(price, str) and price.isdigit():
-                        price = int(price)
-                    elif isinstance(price, (int, float)):
-                        price = int(price)
-                except:
-                    pass
-                address_data.append([name, address, price, status, field_values, record_id])
         return address_data
     except Exception as e:
-        print(f"API 요청 중 예외 발생: {str(e)}")
+        logger.error("API 요청 중 예외 발생: %s", e)
         return []
 
 def geocode_address(address):
-    url = "https://api.vworld.kr/req/address"
-    params = {
-        "service": "address",
-        "request": "getcoord",
-        "format": "json",
-        "crs": "EPSG:4326",
-        "type": "PARCEL",
-        "address": address,
-        "key": vworld_apikey
-    }
     try:
-        response = requests.get(url, params=params)
-        data = response.json()
+        response = session.get(vworld_geocode_url, params={**vworld_geocode_params, "address": address}, timeout=request_timeout)
+        data = loads_json(response.content)
         if data['response']['status'] == 'OK':
             result = data['response']['result']
             return float(result['point']['y']), float(result['point']['x'])
     except Exception as e:
-        print(f"주소 변환 실패: {address}, 에러: {e}")
+        logger.warning("주소 변환 실패: %s, 에러: %s", address, e)
     return None, None
 
-def create_map():
-    folium_map = folium.Map(location=[37.4834458778777, 126.970207234818], zoom_start=15)
-    folium_map._name = 'leafletMap'  # 변수명 변경
-    folium.TileLayer(
-        tiles='https://goldenrabbit.biz/api/vtile?z={z}&y={y}&x={x}',
-        attr='공간정보 오픈플랫폼(브이월드)',
-        name='브이월드 배경지도',
-    ).add_to(folium_map)
-    folium.WmsTileLayer(
-        url='https://goldenrabbit.biz/api/wms?',
-        layers='lt_c_landinfobasemap',
-        request='GetMap',
-        version='1.3.0',
-        height=256,
-        width=256,
-        fmt='image/png',
-        transparent=True,
-        name='LX맵(편집지적도)',
-    ).add_to(folium_map)
-    folium.LayerControl().add_to(folium_map)
+def load_geocode_cache():
+    """주소별 지오코딩 결과 캐시 로드 ({주소: [위도, 경도, 저장 시각(epoch)]})"""
+    try:
+        with open(geocode_cache_file, 'rb') as f:
+            return loads_json(f.read())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:  # json/orjson 디코드 오류는 모두 ValueError 하위 클래스
+        # 캐시를 읽지 못해도 지도 생성은 계속 진행 (모든 주소를 다시 조회)
+        logger.warning("지오코딩 캐시 로드 실패: %s, 에러: %s", geocode_cache_file, e)
+        return {}
 
-    # CSS 스타일 추가
-    folium_map.get_root().header.add_child(folium.Element("""
-    <style>
-    /* 가격 말풍선 스타일 */
-    .price-bubble {
-        background-color: #fff;
-        border: 2px solid #e38000;
-        border-radius: 6px;
-        box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-        padding: 3px 6px;
-        font-size: 13px;
-        font-weight: bold;
-        color: #e38000;
-        white-space: nowrap;
-        text-align: center;
-        position: absolute;
-        left: 50%;
-        transform: translateX(-50%);
-        width: 70px;
-    }
-    .price-bubble:after {
-        content: '';
-        position: absolute;
-        bottom: -8px;
-        left: 50%;
-        margin-left: -8px;
-        width: 0;
-        height: 0;
-        border-left: 8px solid transparent;
-        border-right: 8px solid transparent;
-        border-top: 8px solid #e38000;
-    }
+def save_geocode_cache(cache):
+    # 저장 도중 중단되어도 기존 캐시 파일이 깨지지 않도록 원자적으로 교체
+    try:
+        write_file_atomic(geocode_cache_file, dumps_json(cache).encode('utf-8'))
+    except OSError as e:
+        # 캐시 저장 실패로 지도 생성이 중단되지 않도록 경고만 남김
+        logger.warning("지오코딩 캐시 저장 실패: %s, 에러: %s", geocode_cache_file, e)
+
+def normalize_address(address):
+    """캐시 키로 쓰기 위해 주소 앞뒤 공백 제거 및 연속 공백을 하나로 정리
+    (맥에서 복사한 주소처럼 한글 자모가 분리된(NFD) 문자열도 같은 키가 되도록 NFC로 정규화)"""
+    return unicodedata.normalize('NFC', ' '.join(address.split()))
+
+def geocode_addresses(addresses):
+    """주소 목록을 좌표 목록으로 변환 (디스크 캐시 우선, 캐시에 없거나 오래된 주소만 병렬 조회)"""
+    cache = load_geocode_cache()
+    keys = [normalize_address(address) for address in addresses]
+    expire_before = time.time() - geocode_cache_ttl
+
+    # 같은 건물의 여러 매물처럼 중복된 주소는 한 번만 조회
+    # (저장 시각이 없거나 만료된 항목도 다시 조회하되, 조회에 실패하면 기존 좌표를 계속 사용)
+    missing = list(dict.fromkeys(
+        key for key in keys
+        if key not in cache or len(cache[key]) < 3 or cache[key][2] < expire_before
+    ))
+    # 매물 목록에서 빠진 주소는 공개 경로의 캐시 파일에 남지 않도록 제거
+    stale = cache.keys() - set(keys)
+    for key in stale:
+        del cache[key]
+    if missing:
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            for key, (lat, lon) in zip(missing, executor.map(geocode_address, missing)):
+                if lat is not None and lon is not None:
+                    cache[key] = [lat, lon, int(time.time())]
+    if missing or stale:
+        save_geocode_cache(cache)
+    return [tuple(cache[key][:2]) if key in cache else (None, None) for key in keys]
+
+def to_float(value):
+    """필터용 숫자 변환 (빈 값이나 숫자가 아닌 값은 0)"""
+    try:
+        return float(value) if value else 0
+    except (TypeError, ValueError):
+        return 0
+
+def format_price(price):
+    """말풍선과 팝업에 표시할 가격 문자열 (숫자가 아닌 값은 그대로 표시)"""
+    if not isinstance(price, int):
+        return price or "가격정보 없음"
+    if price < 10000:
+        return f"{price:,}만원"
+    return f"{price / 10000:.1f}".rstrip('0').rstrip('.') + "억원"
+
+def write_file_atomic(path, data):
+    """임시 파일에 쓴 뒤 교체해, 웹 서버가 쓰는 중인 파일을 읽어 잘린 내용을 보내지 않도록 함"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def write_compressed_copies(path, data):
+    """웹 서버(nginx gzip_static/brotli_static)가 요청마다 압축하지 않도록 미리 압축한 .gz/.br 파일 생성"""
+    write_file_atomic(path + '.gz', gzip.compress(data, compresslevel=9))
+    if brotli is not None:
+        write_file_atomic(path + '.br', brotli.compress(data, quality=11))
+
+def write_map_css():
+    """지도 스타일 파일을 내용이 바뀌었을 때만 다시 저장 (파일 시간이 유지되어 웹 서버 캐시 검증이 유효함)"""
+    try:
+        with open(map_css_file, 'r', encoding='utf-8') as f:
+            if f.read() == map_css:
+                return
+    except OSError:
+        pass
+    data = map_css.encode('utf-8')
+    write_file_atomic(map_css_file, data)
+    write_compressed_copies(map_css_file, data)
+    logger.info("지도 스타일이 %s 파일로 저장되었습니다.", map_css_file)
+
+# 지도 페이지 스크립트 템플릿 (create_map에서 데이터와 folium 객체 이름만 채움)
+# $properties_json: 매물 데이터(propertyColumns), $map_name/$cluster_name: folium 지도와 클러스터 변수명, $tile_url: 배경지도 타일 주소
+map_script_template = Template("""
+    <script>
+    var propertyColumns = $properties_json;
+    var propertyCount = propertyColumns.lat.length;
     
-    /* 팝업창 스타일 */
-    .leaflet-popup-content-wrapper {
-        border-radius: 8px;
-        box-shadow: 0 3px 8px rgba(0,0,0,0.2);
-        padding: 0;
-    }
-    .leaflet-popup-content {
-        margin: 8px 10px;
-        font-size: 14px;
-        line-height: 1.5;
-    }
-    .leaflet-popup-tip {
-        box-shadow: 0 3px 8px rgba(0,0,0,0.2);
-    }
-    .popup-content {
-        font-family: 'Noto Sans KR', sans-serif;
+    // 필터에서 반복 비교하는 값은 한 번만 변환 (숫자 열은 typed array, 사용승인일은 시각 값, 없으면 NaN)
+    ['price', 'investment', 'yield', 'area'].forEach(function(key) {
+        propertyColumns[key] = Float64Array.from(propertyColumns[key]);
+    });
+    var approvalTimes = propertyColumns.approval_date.map(function(date) {
+        return date ? new Date(date).getTime() : NaN;
+    });
+    
+    // 마커 참조 저장 (propertyColumns와 같은 인덱스)
+    var markers = [];
+    
+    // 한 단계 낮은 줌 레벨의 배경지도 타일을 미리 받아 축소/이동 시 빈 타일 노출을 줄임
+    var tileUrl = $tile_url;
+    var prefetchedTiles = {};
+    function prefetchParentTiles() {
+        var zoom = $map_name.getZoom() - 1;
+        if (zoom < 0) {
+            return;
+        }
+        var bounds = $map_name.getPixelBounds();
+        var min = bounds.min.divideBy(512).floor();
+        var max = bounds.max.divideBy(512).floor();
+        for (var x = min.x; x <= max.x; x++) {
+            for (var y = min.y; y <= max.y; y++) {
+                var src = L.Util.template(tileUrl, {z: zoom, x: x, y: y});
+                if (!prefetchedTiles[src]) {
+                    prefetchedTiles[src] = true;
+                    new Image().src = src;
+                }
+            }
+        }
     }
-    .popup-title {
-        font-size: 16px;
-        font-weight: bold;
-        margin-bottom: 6px;
-        color: #333;
+    
+    // 가격 말풍선 아이콘 (같은 가격 문구의 마커는 아이콘 객체를 공유)
+    var bubbleIcons = {};
+    function makeBubbleIcon(priceDisplay) {
+        if (!bubbleIcons[priceDisplay]) {
+            bubbleIcons[priceDisplay] = L.divIcon({
+                html: '<div class="price-bubble">' + escapeHtml(priceDisplay) + '</div>',
+                iconSize: [100, 40],
+                iconAnchor: [50, 40],
+                className: 'empty'
+            });
+        }
+        return bubbleIcons[priceDisplay];
     }
-    .popup-info {
-        margin-top: 2px;
-        color: #444;
+    
+    // 에어테이블 값을 HTML에 넣기 전에 이스케이프 (주소 등에 따옴표나 태그가 있어도 마크업이 깨지지 않도록)
+    var htmlEscapes = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'};
+    function escapeHtml(value) {
+        return String(value).replace(/[&<>"']/g, function(ch) {
+            return htmlEscapes[ch];
+        });
     }
-    /* 상세내역 보기 링크 스타일 */
-    .detail-link {
-        display: block;
-        margin-top: 10px;
-        padding: 5px;
-        background-color: #f5f5f5;
-        border-top: 1px solid #e0e0e0;
-        text-align: center;
-        font-weight: bold;
-        color: #e38000;
-        cursor: pointer;
-        text-decoration: none;
-        border-radius: 0 0 6px 6px;
+    
+    // 팝업 링크는 값 대신 인덱스만 넘기고, 실제 값은 propertyColumns에서 조회
+    function openDetailByIndex(index) {
+        parent.openPropertyDetail(propertyColumns.record_id[index]);
     }
-    .detail-link:hover {
-        background-color: #e6e6e6;
+    function openConsultByIndex(index) {
+        parent.openConsultModal(propertyColumns.address[index]);
     }
-    </style>
-    
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Noto+Sans+KR:wght@400;700&display=swap" rel="stylesheet">
-    """))
-
-    address_data = get_airtable_data()
-    if not address_data:
-        print("에어테이블에서 가져온 주소 데이터가 없습니다.")
-        return folium_map
-
-    # JavaScript 데이터 수집
-    javascript_data = []
-    marker_index = 0
-
-    for addr in address_data:
-        name, address, price, status, field_values, record_id = addr
-        lat, lon = geocode_address(address)
-        if lat is None or lon is None:
-            continue
-
-        # JavaScript 데이터에 추가 (가격 필드 수정)
-        property_price = price if price else field_values.get('매가(만원)', 0)
-        try:
-            property_price = float(property_price) if property_price else 0
-        except:
-            property_price = 0
-            
-        javascript_data.append({
-            'index': marker_index,
-            'lat': lat,
-            'lon': lon,
-            'name': name,
-            'address': address,
-            'price': property_price,  # 수정된 부분
-            'investment': float(field_values.get('실투자금', 0)) if field_values.get('실투자금') else 0,
-            'yield': float(field_values.get('융자제외수익률(%)', 0)) if field_values.get('융자제외수익률(%)') else 0,
-            'area': float(field_values.get('토지면적(㎡)', 0)) if field_values.get('토지면적(㎡)') else 0,
-            'approval_date': field_values.get('사용승인일', ''),
-            'record_id': record_id,
-            'layers': field_values.get('층수', ''),
-            'usage': field_values.get('주용도', ''),
-            'land_area': field_values.get('토지면적(㎡)', 0)
-        })
-
-        price_display = f"{price:,}만원" if isinstance(price, int) and price < 10000 else f"{price / 10000:.1f}억원".rstrip('0').rstrip('.') if isinstance(price, int) else (price or "가격정보 없음")
-
-        # 에어테이블 레코드 링크 생성
-        detail_url = f"/property-detail.html?id={record_id}"
-        
-        # 개선된 팝업 HTML 구조
-        popup_html = f"""
-        <div class="popup-content">
-            <div class="popup-title">{name}</div>
-            <div class="popup-info">매가: {price_display}</div>
-        """
-        
-        if field_values.get('토지면적(㎡)'):
-            try:
-                sqm = float(field_values['토지면적(㎡)'])
-                pyeong = round(sqm / 3.3058)
-                popup_html += f'<div class="popup-info">대지: {pyeong}평 ({sqm}㎡)</div>'
-            except:
-                pass
-                
-        if field_values.get('층수'):
-            popup_html += f'<div class="popup-info">층수: {field_values["층수"]}</div>'
-            
-        if field_values.get('주용도'):
-            popup_html += f'<div class="popup-info">용도: {field_values["주용도"]}</div>'
-        
-        # 상세내역 보기 링크 추가
-        popup_html += f'<a href="javascript:void(0);" onclick="parent.openPropertyDetail(\'{record_id}\')" class="detail-link">상세내역보기-클릭</a>'
-        # 이 매물 문의하기 링크 추가
-        popup_html += f'<a href="javascript:void(0);" onclick="parent.openConsultModal(\'{address}\')" class="detail-link" style="background-color:#2962FF; color:white; margin-top:5px;">이 매물 문의하기</a>'
-
-        popup_html += "</div>"
-
-        bubble_html = f'<div class="price-bubble">{price_display}</div>'
-        icon = folium.DivIcon(
-            html=bubble_html,
-            icon_size=(100, 40),
-            icon_anchor=(50, 40),
-            class_name="empty"
-        )
-
-        marker = folium.Marker(
-            location=[lat, lon],
-            popup=folium.Popup(popup_html, max_width=250),
-            icon=icon
-        )
-        marker._name = f"marker_{marker_index}"
-        marker.add_to(folium_map)
-        marker_index += 1
-
-    # JavaScript 필터링 코드 추가
-    javascript_code = f"""
-    <script>
-    var allProperties = {json.dumps(javascript_data, ensure_ascii=False)};
     
-    // 마커 참조 저장
-    var markers = {{}};
+    // 팝업 내용은 마커를 처음 열 때 생성
+    function buildPopupHtml(index) {
+        var c = propertyColumns;
+        var html = '<div class="popup-content"><div class="popup-title">' + escapeHtml(c.address[index]) + '</div>'
+            + '<div class="popup-info">매가: ' + escapeHtml(c.price_display[index]) + '</div>';
+        if (c.area[index]) {
+            html += '<div class="popup-info">대지: ' + Math.round(c.area[index] / 3.3058) + '평 (' + c.area[index] + '㎡)</div>';
+        }
+        if (c.layers[index]) {
+            html += '<div class="popup-info">층수: ' + escapeHtml(c.layers[index]) + '</div>';
+        }
+        if (c.usage[index]) {
+            html += '<div class="popup-info">용도: ' + escapeHtml(c.usage[index]) + '</div>';
+        }
+        // 상세내역 보기 / 이 매물 문의하기 링크
+        html += '<a href="javascript:void(0);" onclick="openDetailByIndex(' + index + ')" class="detail-link">상세내역보기-클릭</a>'
+            + '<a href="javascript:void(0);" onclick="openConsultByIndex(' + index + ')" class="detail-link" style="background-color:#2962FF; color:white; margin-top:5px;">이 매물 문의하기</a>'
+            + '</div>';
+        return html;
+    }
     
     // Leaflet 맵이 로드된 후 실행
-    document.addEventListener('DOMContentLoaded', function() {{
-        if (typeof {folium_map._name} !== 'undefined') {{
-            {folium_map._name}.eachLayer(function(layer) {{
-                if (layer instanceof L.Marker) {{
-                    var markerName = layer._myName;
-                    if (markerName && markerName.startsWith('marker_')) {{
-                        var index = parseInt(markerName.split('_')[1]);
-                        markers[index] = layer;
-                    }}
-                }}
-            }});
-        }}
-    }});
+    document.addEventListener('DOMContentLoaded', function() {
+        if (typeof $map_name === 'undefined') {
+            return;
+        }
+        // 마커를 모두 만든 뒤 클러스터에 한 번에 추가 (마커마다 클러스터를 다시 계산하지 않도록)
+        for (var i = 0; i < propertyCount; i++) {
+            markers[i] = L.marker([propertyColumns.lat[i], propertyColumns.lon[i]], {icon: makeBubbleIcon(propertyColumns.price_display[i])})
+                .bindPopup(buildPopupHtml.bind(null, i), {maxWidth: 250});
+        }
+        $cluster_name.addLayers(markers);
+        $map_name.on('moveend', prefetchParentTiles);
+        prefetchParentTiles();
+    });
     
-    function filterProperties(conditions) {{
+    function filterProperties(conditions) {
         console.log('filterProperties 호출됨', conditions);
-        var filteredProperties = [];
-        var totalCount = allProperties.length;
         var filteredCount = 0;
+        var markersToShow = [];
+        var markersToHide = [];
+        
+        // 매가/실투자금/수익률/토지면적 조건을 (열, 기준값, 조건) 목록으로 한 번만 정리
+        var ranges = [];
+        function addRange(column, value, condition) {
+            if (value && condition !== 'all') {
+                ranges.push({column: column, value: parseFloat(value), condition: condition});
+            }
+        }
+        addRange(propertyColumns.price, conditions.price_value, conditions.price_condition);
+        addRange(propertyColumns.investment, conditions.investment_value, conditions.investment_condition);
+        addRange(propertyColumns.yield, conditions.yield_value, conditions.yield_condition);
+        addRange(propertyColumns.area, conditions.area_value, conditions.area_condition);
+        
+        // 사용승인일 조건 (사용승인일이 없는 매물은 조건과 관계없이 표시)
+        var approvalCondition = null;
+        var targetTime = NaN;
+        if (conditions.approval_date && conditions.approval_condition !== 'all') {
+            approvalCondition = conditions.approval_condition;
+            targetTime = new Date(conditions.approval_date).getTime();
+        }
         
-        allProperties.forEach(function(property, index) {{
+        for (var i = 0; i < propertyCount; i++) {
             var shouldShow = true;
             
-            // 디버깅용 로그
-            console.log('Property ' + index + ':', property);
+            for (var r = 0; r < ranges.length && shouldShow; r++) {
+                var value = ranges[r].column[i];
+                if (ranges[r].condition === 'above' && value < ranges[r].value) shouldShow = false;
+                if (ranges[r].condition === 'below' && value > ranges[r].value) shouldShow = false;
+            }
             
-            // 매가 조건
-            if (conditions.price_value && conditions.price_condition !== 'all') {{
-                var price = parseFloat(property.price) || 0;
-                var priceVal = parseFloat(conditions.price_value);
-                console.log('가격 비교: ' + price + ' vs ' + priceVal + ' (조건: ' + conditions.price_condition + ')');
-                if (conditions.price_condition === 'above' && price < priceVal) shouldShow = false;
-                if (conditions.price_condition === 'below' && price > priceVal) shouldShow = false;
-            }}
+            if (shouldShow && approvalCondition && propertyColumns.approval_date[i]) {
+                if (approvalCondition === 'before' && approvalTimes[i] >= targetTime) shouldShow = false;
+                if (approvalCondition === 'after' && approvalTimes[i] <= targetTime) shouldShow = false;
+            }
             
-            // 실투자금 조건
-            if (conditions.investment_value && conditions.investment_condition !== 'all') {{
-                var investment = parseFloat(property.investment) || 0;
-                var investmentVal = parseFloat(conditions.investment_value);
-                if (conditions.investment_condition === 'above' && investment < investmentVal) shouldShow = false;
-                if (conditions.investment_condition === 'below' && investment > investmentVal) shouldShow = false;
-            }}
-            
-            // 수익률 조건
-            if (conditions.yield_value && conditions.yield_condition !== 'all') {{
-                var yieldRate = parseFloat(property.yield) || 0;
-                var yieldVal = parseFloat(conditions.yield_value);
-                if (conditions.yield_condition === 'above' && yieldRate < yieldVal) shouldShow = false;
-                if (conditions.yield_condition === 'below' && yieldRate > yieldVal) shouldShow = false;
-            }}
-            
-            // 토지면적 조건
-            if (conditions.area_value && conditions.area_condition !== 'all') {{
-                var area = parseFloat(property.area) || 0;
-                var areaVal = parseFloat(conditions.area_value);
-                if (conditions.area_condition === 'above' && area < areaVal) shouldShow = false;
-                if (conditions.area_condition === 'below' && area > areaVal) shouldShow = false;
-            }}
-            
-            // 사용승인일 조건
-            if (conditions.approval_date && conditions.approval_condition !== 'all') {{
-                var approval = property.approval_date;
-                if (approval) {{
-                    var approvalDate = new Date(approval);
-                    var targetDate = new Date(conditions.approval_date);
-                    if (conditions.approval_condition === 'before' && approvalDate >= targetDate) shouldShow = false;
-                    if (conditions.approval_condition === 'after' && approvalDate <= targetDate) shouldShow = false;
-                }}
-            }}
-            
-            if (shouldShow) {{
-                filteredProperties.push(property);
+            if (shouldShow) {
                 filteredCount++;
-            }}
+            }
             
             // 마커 표시/숨김
-            var marker = markers[index];
-            if (marker) {{
-                if (shouldShow) {{
-                    marker.addTo({folium_map._name});
-                }} else {{
-                    {folium_map._name}.removeLayer(marker);
-                }}
-            }}
-        }});
+            var marker = markers[i];
+            if (marker) {
+                if (shouldShow) {
+                    if (!$cluster_name.hasLayer(marker)) markersToShow.push(marker);
+                } else if ($cluster_name.hasLayer(marker)) {
+                    markersToHide.push(marker);
+                }
+            }
+        }
+        
+        // 클러스터 재계산이 한 번씩만 일어나도록 모아서 추가/제거
+        $cluster_name.removeLayers(markersToHide);
+        $cluster_name.addLayers(markersToShow);
         
-        console.log('필터링 결과: ' + filteredCount + '/' + totalCount);
-        return filteredProperties;
-    }}
+        console.log('필터링 결과: ' + filteredCount + '/' + propertyCount);
+        return filteredCount;
+    }
     
     // 전체 마커 표시
-    function showAllMarkers() {{
-        Object.values(markers).forEach(function(marker) {{
-            marker.addTo({folium_map._name});
-        }});
-    }}
+    function showAllMarkers() {
+        $cluster_name.addLayers(markers.filter(function(marker) {
+            return !$cluster_name.hasLayer(marker);
+        }));
+    }
     
     // 부모 창과 통신
-    window.addEventListener('message', function(event) {{
-        if (event.data.type === 'filter') {{
-            var filtered = filterProperties(event.data.conditions);
+    window.addEventListener('message', function(event) {
+        if (event.data.type === 'filter') {
+            var count = filterProperties(event.data.conditions);
             // 부모 창에 결과 전송
-            parent.postMessage({{
+            parent.postMessage({
                 type: 'filterResult',
-                count: filtered.length
-            }}, '*');
-        }} else if (event.data.type === 'reset') {{
+                count: count
+            }, '*');
+        } else if (event.data.type === 'reset') {
             showAllMarkers();
-            parent.postMessage({{
+            parent.postMessage({
                 type: 'filterResult',
-                count: allProperties.length
-            }}, '*');
-        }}
-    }});
-    
-    // 마커에 인덱스 저장
-    document.addEventListener('DOMContentLoaded', function() {{
-        if (typeof {folium_map._name} !== 'undefined') {{
-            {folium_map._name}.eachLayer(function(layer) {{
-                if (layer instanceof L.Marker && layer.options.icon) {{
-                    var iconHtml = layer.options.icon.options.html;
-                    var match = iconHtml.match(/>([\d,]+)만원<|>([\d.]+)억원</);
-                    if (match) {{
-                        var priceText = match[1] || match[2];
-                        for (var i = 0; i < allProperties.length; i++) {{
-                            var prop = allProperties[i];
-                            var propPrice = prop.price;
-                            var displayPrice = propPrice < 10000 ? 
-                                (propPrice + '').replace(/\B(?=(\d{{3}})+(?!\d))/g, ',') + '만원' :
-                                (propPrice / 10000).toFixed(1).replace(/\.0$/, '') + '억원';
-                            
-                            if (displayPrice.includes(priceText)) {{
-                                layer._myName = 'marker_' + i;
-                                markers[i] = layer;
-                                break;
-                            }}
-                        }}
-                    }}
-                }}
-            }});
-        }}
-    }});
+                count: propertyCount
+            }, '*');
+        }
+    });
     </script>
-    """
-    
+    """)
+
+def create_map(address_data=None, coords=None):
+    folium_map = folium.Map(location=[37.4834458778777, 126.970207234818], zoom_start=15)
+    folium_map._name = 'leafletMap'  # 변수명 변경
+    # keep_buffer: 화면 밖 타일을 더 오래 유지해 빠르게 이동할 때 빈 타일이 보이지 않게 함
+    folium.TileLayer(
+        tiles=vworld_tile_url,
+        attr='공간정보 오픈플랫폼(브이월드)',
+        name='브이월드 배경지도',
+        keep_buffer=4,
+    ).add_to(folium_map)
+    folium.WmsTileLayer(
+        url='https://goldenrabbit.biz/api/wms?',
+        layers='lt_c_landinfobasemap',
+        request='GetMap',
+        version='1.3.0',
+        height=256,
+        width=256,
+        fmt='image/png',
+        transparent=True,
+        name='LX맵(편집지적도)',
+        keep_buffer=4,
+    ).add_to(folium_map)
+    folium.LayerControl().add_to(folium_map)
+
+    # 스타일은 별도 파일(브라우저 캐시)로 분리하고, 웹폰트 CSS는 렌더링을 막지 않도록 비동기로 적용
+    folium_map.get_root().header.add_child(folium.Element(f"""
+    <link rel="stylesheet" href="{os.path.basename(map_css_file)}?v={map_css_version}">
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+    <link href="{font_css_url}" rel="stylesheet" media="print" onload="this.media='all'">
+    <noscript><link href="{font_css_url}" rel="stylesheet"></noscript>
+    """))
+
+    if address_data is None:
+        address_data = get_airtable_data()
+    if not address_data:
+        logger.warning("에어테이블에서 가져온 주소 데이터가 없습니다.")
+        return folium_map
+
+    # JavaScript 데이터 수집 (매물별 객체 대신 항목별 배열로 담아 키 이름 반복을 없앰, 같은 인덱스가 같은 매물)
+    # 스크립트에서 쓰는 값만 담고, 좌표는 소수점 5자리(약 1m)로 줄여 HTML 크기를 줄임
+    # (팝업 HTML은 미리 만들지 않고 마커를 클릭할 때 이 값으로 브라우저에서 생성)
+    property_columns = {key: [] for key in (
+        'lat', 'lon', 'address', 'record_id', 'price', 'investment', 'yield', 'area',
+        'approval_date', 'layers', 'usage', 'price_display',
+    )}
+
+    # coords: address_data와 같은 순서의 (위도, 경도) 목록 (이미 조회한 경우 전달, 없으면 여기서 조회)
+    if coords is None:
+        coords = geocode_addresses([addr[1] for addr in address_data])
+
+    for addr, (lat, lon) in zip(address_data, coords):
+        name, address, price, status, field_values, record_id = addr
+        if lat is None or lon is None:
+            continue
+
+        property_columns['lat'].append(round(lat, 5))
+        property_columns['lon'].append(round(lon, 5))
+        property_columns['address'].append(address)
+        property_columns['record_id'].append(record_id)
+        property_columns['price'].append(to_float(price))
+        property_columns['investment'].append(to_float(field_values.get('실투자금')))
+        property_columns['yield'].append(to_float(field_values.get('융자제외수익률(%)')))
+        property_columns['area'].append(to_float(field_values.get('토지면적(㎡)')))
+        property_columns['approval_date'].append(field_values.get('사용승인일') or '')
+        property_columns['layers'].append(field_values.get('층수') or '')
+        property_columns['usage'].append(field_values.get('주용도') or '')
+        property_columns['price_display'].append(format_price(price))
+
+    # 마커는 folium 객체로 하나씩 렌더링하지 않고, 아래 스크립트가 propertyColumns 배열로 한 번에 생성
+    map_name = folium_map.get_name()
+
+    # 축소 시 가까운 마커를 묶어 화면에 그리는 DOM 수를 줄임 (기본 줌 15 이상에서는 기존처럼 개별 말풍선 표시)
+    # chunkedLoading: 대량 추가 시 클러스터 계산을 나눠 실행해 페이지가 멈추지 않게 함
+    marker_cluster = MarkerCluster(control=False, disable_clustering_at_zoom=15, chunked_loading=True).add_to(folium_map)
+    cluster_name = marker_cluster.get_name()
+
+    # 데이터 안의 '</' 문자열이 <script> 태그를 닫지 않도록 이스케이프
+    properties_json = dumps_json(property_columns).replace('</', '<\\/')
+
+    # JavaScript 마커 생성 및 필터링 코드 추가 (고정된 스크립트 템플릿에 데이터와 객체 이름만 채움)
+    javascript_code = map_script_template.substitute(
+        properties_json=properties_json,
+        map_name=map_name,
+        cluster_name=cluster_name,
+        tile_url=dumps_json(vworld_tile_url),
+    )
     folium_map.get_root().header.add_child(folium.Element(javascript_code))
 
     return folium_map
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
     cache_file = '/home/sftpuser/www/airtable_map.html'
-    cache_time = 86400
-    current_time = time.time()
+    write_map_css()
 
+    # 캐시 판정은 epoch 초 단위로 비교 (파일 stat은 한 번만)
     KST = timezone(timedelta(hours=9))
     now = datetime.now(KST)
-    today_3am = datetime.combine(now.date(), dtime(3, 0), tzinfo=KST)
-    map_mtime = datetime.fromtimestamp(os.path.getmtime(cache_file), KST) if os.path.exists(cache_file) else None
+    today_3am = datetime.combine(now.date(), dtime(3, 0), tzinfo=KST).timestamp()
+    try:
+        map_mtime = os.path.getmtime(cache_file)
+    except OSError:
+        map_mtime = None
 
     if map_mtime and map_mtime >= today_3am:
-        print(f"캐시된 지도를 사용합니다. (생성 시간: {map_mtime})")
+        logger.info("캐시된 지도를 사용합니다. (생성 시간: %s)", datetime.fromtimestamp(map_mtime, KST))
     else:
-        print("새 지도를 생성합니다...")
-        folium_map = create_map()
-        folium_map.save(cache_file)
-        print(f"지도가 {cache_file} 파일로 저장되었습니다.")
\ No newline at end of file
+        address_data = get_airtable_data()
+        # 지오코딩은 건너뛰기 판정 전에 매번 실행 (캐시 만료 항목 갱신, 이전에 실패한 주소 재조회)
+        coords = geocode_addresses([addr[1] for addr in address_data])
+
+        # 데이터, 좌표, 스크립트가 이전 생성 시와 같으면 지도를 다시 만들지 않고 생성 시간만 갱신
+        # (좌표를 포함해야 조회에 실패해 빠졌던 매물이 나중에 조회되면 지도를 다시 생성함)
+        hash_file = cache_file + '.hash'
+        with open(__file__, 'rb') as f:
+            source = f.read()
+        data_hash = hashlib.blake2b(source + dumps_json([address_data, coords]).encode('utf-8'), digest_size=16).hexdigest()
+        previous_hash = None
+        if os.path.exists(hash_file):
+            with open(hash_file, 'r') as f:
+                previous_hash = f.read().strip()
+
+        if address_data and map_mtime and previous_hash == data_hash:
+            os.utime(cache_file, None)
+            logger.info("에어테이블 데이터가 변경되지 않아 기존 지도를 유지합니다.")
+        else:
+            logger.info("새 지도를 생성합니다...")
+            folium_map = create_map(address_data, coords)
+            html = folium_map.get_root().render().encode('utf-8')
+            write_file_atomic(cache_file, html)
+            write_compressed_copies(cache_file, html)
+            with open(hash_file, 'w') as f:
+                f.write(data_hash)
+            logger.info("지도가 %s 파일로 저장되었습니다.", cache_file)
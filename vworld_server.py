@@ -180,10 +180,15 @@ def vworld_tile():
         url = f"https://api.vworld.kr/req/wmts/1.0.0/{vworld_key}/Base/{z}/{y}/{x}.png"
         response = requests.get(url)
         
+        headers = {'Content-Type': response.headers.get('Content-Type', 'image/png')}
+        # 배경지도 타일은 자주 바뀌지 않으므로 브라우저 캐시 허용 (지도 페이지의 타일 미리 받기와 함께 사용)
+        if response.status_code == 200:
+            headers['Cache-Control'] = 'public, max-age=86400'
+        
         return make_response(
             response.content, 
             response.status_code,
-            {'Content-Type': response.headers.get('Content-Type', 'image/png')}
+            headers
         )
     except Exception as e:
         logger.error(f"Tile proxy error: {str(e)}")